@@ -5,16 +5,48 @@ containing the traces and, optionally, a `.json` file for all the other
 settings.
 """
 import argparse
-import csv
+import functools
 import json
 import os
+import re
+from typing import Iterable
 
+# columns of the csv files containing the traces
+TRACE_COLUMNS = ('frequency', 'real', 'imaginary')
 
+# url encoded tokens found in the keys and their replacement, all the
+# delimitation tokens are converted to be the same and %20 is a space
+_TOKENS = {'%5B': '\\', '%5D.': '\\', '%5D': '\\', '-%3E': '\\', '%20': ' '}
+_TOKEN_RE = re.compile(r'%5B|%5D\.?|-%3E|%20')
+
+# pattern of the string representations of integers and floats, the
+# `float` group only matches for floats
+_NUMBER_RE = re.compile(
+    r'[+-]?(?:\d+|(?P<float>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?))',
+    re.ASCII)
+# pattern of the non-finite floats, spelled as accepted by `float`
+_NON_FINITE_RE = re.compile(r'[+-]?(?:inf|infinity|nan)', re.IGNORECASE)
+
+# returned by `boolify` when a string doesn't represent a boolean
+_NOT_BOOL = object()
+
+# sections of a `.trs` file containing the points of a trace
+TRACE_SECTIONS = ('Trace', 'MemoryTrace')
+
+
+@functools.lru_cache(maxsize=4096)
 def auto_cast(value: str) -> bool | int | float | str:
     """Cast a string representation of a value into the correct type.
 
     The string can be a representation of a boolean, an integer or a
-    float. If the string can't be cast, it is returned as is.
+    float. If the string can't be cast, it is returned as is. The results
+    are cached since many values are repeated in a `.trs` file.
+
+    Numbers are written with ASCII digits, an optional sign, decimal
+    point and exponent, or as 'nan', 'inf' or 'infinity' in any case.
+    Surrounding whitespace and underscores between digits are accepted
+    as by `int` and `float`, but non-ASCII digits aren't, such strings
+    are returned as is.
 
     Parameters
     ----------
@@ -26,19 +58,43 @@ def auto_cast(value: str) -> bool | int | float | str:
     bool | int | float | str
         The value cast in the correct type.
     """
-    for caster in (boolify, int, float):
-        try:
-            return caster(value)
-        except ValueError:
-            pass
+    boolean = boolify(value)
+    if boolean is not _NOT_BOOL:
+        return boolean
+
+    if not value:
+        return value
+
+    # only match the numeric patterns if the value begins like a number,
+    # the casts are then guaranteed to succeed without raising exceptions
+    first = value[0]
+    if first in '+-.0123456789':
+        match = _NUMBER_RE.fullmatch(value)
+        if match:
+            if match.group('float') is None:
+                return int(value)
+            return float(value)
+    if first in '+-iInN' and _NON_FINITE_RE.fullmatch(value):
+        return float(value)
+
+    # the patterns don't handle surrounding whitespace nor underscores,
+    # these rare values are cast as `int` and `float` would
+    if first.isspace() or value[-1].isspace() or '_' in value:
+        for caster in (int, float):
+            try:
+                return caster(value)
+            except ValueError:
+                pass
     return value
 
 
-def boolify(value: str) -> bool:
-    """Cast a string into a boolean if it is one, else raises an error.
+def boolify(value: str) -> bool | object:
+    """Cast a string into a boolean if it is one, else returns the
+    `_NOT_BOOL` sentinel.
 
     Accepted strings are 'True' and 'true' for `True` and 'False' and
-    'false' for `False`.
+    'false' for `False`. A sentinel is returned instead of raising an
+    error since most strings aren't booleans.
 
     Parameters
     ----------
@@ -47,21 +103,15 @@ def boolify(value: str) -> bool:
 
     Returns
     -------
-    bool
-        True if the string is 'True' or 'true' and false if the string
-        is 'False' or 'false'.
-
-    Raises
-    ------
-    ValueError
-        If the string is neither 'True', 'true', 'False' or 'false', the
-        value can't be converted into a into a boolean.
+    bool | object
+        True if the string is 'True' or 'true', false if the string is
+        'False' or 'false' and `_NOT_BOOL` if the string is neither.
     """
     if value == 'True' or value == 'true':
         return True
     if value == 'False' or value == 'false':
         return False
-    raise ValueError(f"Can't interpret '{value}' as a boolean.")
+    return _NOT_BOOL
 
 
 class File_Type(object):
@@ -117,6 +167,35 @@ class File_Type(object):
         return path
 
 
+class Trace_Section(dict):
+    """Dictionary of a section containing the points of a trace.
+
+    The numbered points are stored in the list `points`, indexed from 0,
+    while the other entries (e.g. 'size') are stored in the dictionary.
+    """
+
+    def __init__(self):
+        """Constructor of the class creating an empty list of points."""
+        super().__init__()
+        self.points = []
+
+
+def _replace_token(match: re.Match) -> str:
+    """Give the replacement of a url encoded token found in a key.
+
+    Parameters
+    ----------
+    match : re.Match
+        Match of `_TOKEN_RE` containing the token to replace.
+
+    Returns
+    -------
+    str
+        Delimitation token `\\` or a space for `%20`.
+    """
+    return _TOKENS[match.group(0)]
+
+
 def parse_key(key: str, current_dict: dict, value: any):
     """Split the key in sub dictionaries and assigns the value.
 
@@ -132,41 +211,80 @@ def parse_key(key: str, current_dict: dict, value: any):
     value : any
         Value to assign to the last key.
     """
-    # convert all delimitation tokens to be the same (this could be done
-    # on the entire content of the file to be faster but I'm not sure if
-    # the values could contain these characters)
-    key = key.replace('%5B', '\\')
-    key = key.replace('%5D.', '\\')
-    key = key.replace('%5D', '\\')
-    key = key.replace('-%3E', '\\')
-    # %20 in url encoding is a space
-    key = key.replace('%20', ' ')
+    # convert all delimitation tokens to be the same (this isn't done on
+    # the entire content of the file since it is read line by line and
+    # the values could contain these characters), all the tokens contain
+    # a `%` so most keys (e.g. the trace points) can skip the substitution
+    if '%' in key:
+        key = _TOKEN_RE.sub(_replace_token, key)
 
     # remove token if it is the last character
     key = key.rstrip('\\')
 
-    # repeatedly process the key as long as there is a delimitation token
-    while '\\' in key:
-        # split the key at the first token
-        sub_dict, key = key.split('\\', 1)
-        # create the sub_dict if it doesn't exists
-        if sub_dict not in current_dict:
-            current_dict[sub_dict] = {}
+    # split the key at all the tokens in a single scan
+    sub_keys = key.split('\\')
 
-        # index in the sub dict
-        current_dict = current_dict[sub_dict]
+    # walk the sub dicts, creating them if they don't exist
+    for sub_key in sub_keys[:-1]:
+        current_dict = current_dict.setdefault(sub_key, {})
 
     # assign the value
-    current_dict[key] = value
+    current_dict[sub_keys[-1]] = value
+
 
+def parse_point(key: str, section: Trace_Section, value: any):
+    """Assign the value of a key from a section containing a trace.
 
-def parse_trs(content: str) -> dict:
+    Keys of the form `number\\name`, with `number` a positive integer
+    without leading zeros, are assigned to the point `number` in the list
+    of points of the section, the list is extended as needed since the
+    keys aren't sorted numerically. The name is parsed with
+    `parse_key` in the dictionary of the point if it contains tokens.
+    The other keys are parsed with `parse_key` in the section.
+
+    Parameters
+    ----------
+    key : str
+        Key to parse.
+    section : Trace_Section
+        Dictionary of the section containing the trace.
+    value : any
+        Value to assign to the key.
+    """
+    number, token, name = key.partition('\\')
+    # only the point numbers as written by the VNA (ASCII digits without
+    # a leading zero) go in the list, keys such as `0` or `01` would
+    # otherwise overwrite another point so they stay in the section dict
+    if (not token or not number.isascii() or not number.isdecimal()
+            or number[0] == '0' or not name.rstrip('\\')):
+        parse_key(key, section, value)
+        return
+
+    points = section.points
+    # the points are 1 indexed
+    index = int(number) - 1
+    if index >= len(points):
+        points.extend([None] * (index + 1 - len(points)))
+
+    point = points[index]
+    if point is None:
+        point = points[index] = {}
+    if '\\' in name or '%' in name:
+        parse_key(name, point, value)
+    else:
+        point[name] = value
+
+
+def parse_trs(lines: Iterable[str]) -> dict:
     """Parse the content of a `.trs` file and insert it in a dictionary.
 
+    The content is processed one line at a time so an open file can be
+    passed directly without loading it entirely in memory.
+
     Parameters
     ----------
-    content : str
-        Content of a `.trs` file to parse.
+    lines : Iterable[str]
+        Lines of a `.trs` file to parse (e.g. the opened file).
 
     Returns
     -------
@@ -174,42 +292,77 @@ def parse_trs(content: str) -> dict:
         Dictionnary representation of the content in the `.trs` file.
     """
 
-    def fix_trace(dictionary: dict, start_frequency: float,
-                  frequency_step: float) -> list:
+    def fix_trace(name: str, section: Trace_Section,
+                  frequencies: list) -> list:
+
+        size = section['size']
+        points = section.points[:size]
+        if len(points) < size or None in points:
+            missing = len(points) if None not in points else points.index(None)
+            raise ValueError(
+                f'Point {missing + 1} of the {name} section is missing.')
 
         fixed_trace = []
-        for i in range(dictionary['size']):
+        for i, point in enumerate(points):
             fixed_trace.append({
-                'frequency': start_frequency + i * frequency_step,
-                'real': dictionary[f'{i+1}']['ampy'],
-                'imaginary': dictionary[f'{i+1}']['ampz']
+                'frequency': frequencies[i],
+                'real': point['ampy'],
+                'imaginary': point['ampz']
             })
         return fixed_trace
 
     output = {}
     section = ''
-    for line in content.splitlines():
-        # skip empty line
-        if line == '':
-            continue
-
-        if line.startswith('[') and line.endswith(']'):
+    # the dictionary and the parser of the current section as well as the
+    # casting function are kept in local variables since they are used for
+    # every line
+    current_section = None
+    parse = parse_key
+    cast = auto_cast
+    for line in lines:
+        # lines can keep a `\r` if they weren't read with universal newlines
+        line = line.rstrip('\r\n')
+
+        # the section headers are checked first since they can contain a
+        # `=`, it only costs a character comparison for the other lines
+        if line[:1] == '[' and line[-1] == ']':
             section = line[1:-1]
-            output[section] = {}
+            if section in TRACE_SECTIONS:
+                current_section = Trace_Section()
+                parse = parse_point
+            else:
+                current_section = {}
+                parse = parse_key
+            output[section] = current_section
             continue
 
-        key, value = line.split('=', 1)
-
-        parse_key(key, output[section], auto_cast(value))
+        # split the `key=value` lines in a single scan, the other lines
+        # (e.g. empty lines) are skipped
+        key, separator, value = line.partition('=')
+        if separator:
+            parse(key, current_section, cast(value))
 
+    # the frequencies are computed once for both traces, whichever outputs
+    # are requested since the traces are also part of the config, for as
+    # many points as the longest trace (e.g. a memory trace saved with
+    # other sweep settings can have more points than the current sweep)
     start_frequency = output['VNAGloble']['m_f64StartFreq']
-    frequency_step = (output['VNAGloble']['m_f64Span']
-                      / (output['VNAGloble']['m_s32SweepPoints'] - 1))
-
-    output['Trace'] = fix_trace(output['Trace'],
-                                start_frequency, frequency_step)
-    output['MemoryTrace'] = fix_trace(output['MemoryTrace'],
-                                      start_frequency, frequency_step)
+    span = output['VNAGloble']['m_f64Span']
+    points = output['VNAGloble']['m_s32SweepPoints']
+    count = max(points, *(output[section]['size']
+                          for section in TRACE_SECTIONS))
+    # a sweep of a single point has no step
+    frequency_step = span / (points - 1) if points > 1 else 0.0
+    frequencies = [start_frequency + i * frequency_step
+                   for i in range(count)]
+    if points > 1:
+        # like `numpy.linspace`, the last point of the sweep is exactly at
+        # the end of the span instead of accumulating the rounding errors
+        # of the step
+        frequencies[points - 1] = float(start_frequency + span)
+
+    for section in TRACE_SECTIONS:
+        output[section] = fix_trace(section, output[section], frequencies)
 
     # FIXME: Some other entries may also benefit from being in a list
     # but doing it automatically would be better. Some have a 'size' key
@@ -219,6 +372,28 @@ def parse_trs(content: str) -> dict:
     return output
 
 
+def write_trace(path: str, points: list):
+    """Write the points of a trace in a csv file.
+
+    Parameters
+    ----------
+    path : str
+        Path to the csv file to write.
+    points : list
+        Points of the trace, as returned by `parse_trs`, each containing
+        the keys of `TRACE_COLUMNS`.
+    """
+    with open(path, 'w', newline='') as csv_file:
+        # the rows only contain numbers so they are formatted directly
+        # instead of going through `csv.writer`, with the same line
+        # terminator
+        write = csv_file.write
+        write(','.join(TRACE_COLUMNS) + '\r\n')
+        for point in points:
+            write(f"{point['frequency']},{point['real']},"
+                  f"{point['imaginary']}\r\n")
+
+
 def convert(file_path: str, config: bool, trace: bool, memory: bool,
             output: str) -> dict:
     """Convert the content of the specified file with the `parse_trs`
@@ -254,38 +429,59 @@ def convert(file_path: str, config: bool, trace: bool, memory: bool,
     file_name = os.path.splitext(os.path.basename(file_path))[0]
 
     with open(file_path, 'r') as file:
-        state = parse_trs(file.read())
+        state = parse_trs(file)
 
     if config:
         with open(os.path.join(output, file_name + '_config.json'),
                   'w') as conf_file:
-            conf_file.write(json.dumps(state, indent=2))
+            # written incrementally instead of building the whole json
+            # string in memory
+            json.dump(state, conf_file, indent=2)
 
     if trace:
-        with open(os.path.join(output, file_name + '_trace.csv'),
-                  'w') as csv_file:
-            csv_writer = csv.DictWriter(csv_file,
-                                        ('frequency', 'real', 'imaginary'),
-                                        delimiter=',')
-            csv_writer.writeheader()
-            csv_writer.writerows(state['Trace'])
+        write_trace(os.path.join(output, file_name + '_trace.csv'),
+                    state['Trace'])
 
     if memory and len(state['MemoryTrace']) == 0:
         print(f'No memory trace in file {file_path}, skipping.')
         memory = False
 
     if memory:
-        with open(os.path.join(output, file_name + '_memory.csv'),
-                  'w') as csv_file:
-            csv_writer = csv.DictWriter(csv_file,
-                                        ('frequency', 'real', 'imaginary'),
-                                        delimiter=',')
-            csv_writer.writeheader()
-            csv_writer.writerows(state['MemoryTrace'])
+        write_trace(os.path.join(output, file_name + '_memory.csv'),
+                    state['MemoryTrace'])
 
     return state
 
 
+def convert_file(file_path: str, config: bool, trace: bool, memory: bool,
+                 output: str, verbose: bool):
+    """Convert the specified file with the `convert` method without
+    returning the converted dictionnary.
+
+    Used to convert the files in worker processes without sending the
+    dictionnary back to the main process.
+
+    Parameters
+    ----------
+    file_path : str
+        Path to the `.trs` file containing the data to be converted.
+    config : bool
+        Controls the output of a json file, see `convert`.
+    trace : bool
+        Controls the output of a csv file of the trace, see `convert`.
+    memory : bool
+        Controls the output of a csv file of the memory trace, see
+        `convert`.
+    output : str
+        Directory to save the outputs to.
+    verbose : bool
+        Print the file being processed.
+    """
+    if verbose:
+        print(f'Processing file {file_path}.')
+    convert(file_path, config, trace, memory, output)
+
+
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument_group()
@@ -335,16 +531,31 @@ def main():
     if args.output_dir is not None and not os.path.exists(args.output_dir):
         os.mkdir(args.output_dir)
 
+    jobs = []
     for file in args.file:
-        if args.verbose:
-            print(f'Processing file {file}.')
-
         if args.output_dir is None:
-            convert(file, args.config, args.trace, args.memory,
-                    os.path.dirname(file))
+            output = os.path.dirname(file)
         else:
-            convert(file, args.config, args.trace, args.memory,
-                    args.output_dir)
+            output = args.output_dir
+        jobs.append((file, args.config, args.trace, args.memory, output,
+                     args.verbose))
+
+    if len(jobs) == 1:
+        convert_file(*jobs[0])
+        return
+
+    # the files are independent so they are converted in parallel, the
+    # pool is only imported and started when there are multiple files
+    # since it costs more than the conversion of a single file
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(
+            max_workers=min(len(jobs), os.cpu_count() or 1)) as executor:
+        futures = [executor.submit(convert_file, *job) for job in jobs]
+
+        # wait for all the conversions and raise their errors if any
+        for future in futures:
+            future.result()
 
 
 if __name__ == "__main__":